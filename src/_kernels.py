@@ -0,0 +1,123 @@
+"""Kernels numéricos para los caminos calientes del sistema"""
+
+import math
+
+import numpy as np
+
+# Radio medio de la Tierra en kilómetros
+EARTH_RADIUS_KM = 6371.0088
+
+try:
+    # numba es opcional: si está instalado, los kernels se compilan a código nativo
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        """Fallback sin JIT: los kernels corren como NumPy puro"""
+        if args and callable(args[0]):
+            return args[0]
+
+        def decorator(func):
+            return func
+        return decorator
+
+
+@njit(cache=True)
+def scale_coords(ints: np.ndarray, signs: np.ndarray, scale_mask: np.ndarray) -> np.ndarray:
+    """Aplica signo y escala /1000 a coordenadas ya extraídas como enteros"""
+    out = signs * ints.astype(np.float64)
+    return np.where(scale_mask, out / 1000.0, out)
+
+
+@njit(cache=True, fastmath=True)
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distancia haversine en kilómetros entre dos puntos"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def haversine_matrix(lats, lngs):
+    """Matriz (n, n) de distancias haversine en kilómetros entre todos los puntos"""
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lng = np.radians(np.asarray(lngs, dtype=np.float64))
+    dlat = lat[:, None] - lat[None, :]
+    dlng = lng[:, None] - lng[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+@njit(cache=True)
+def nn_route(distance_matrix: np.ndarray, start_idx: int) -> np.ndarray:
+    """Ruta nearest-neighbor: bucles escalares pensados para compilarse con numba"""
+    n = distance_matrix.shape[0]
+    visited = np.zeros(n, dtype=np.uint8)
+    route = np.empty(n, dtype=np.int64)
+    route[0] = start_idx
+    visited[start_idx] = 1
+    current = start_idx
+
+    for step in range(1, n):
+        best = -1
+        best_dist = np.inf
+        for j in range(n):
+            if visited[j] == 0 and distance_matrix[current, j] < best_dist:
+                best_dist = distance_matrix[current, j]
+                best = j
+        route[step] = best
+        visited[best] = 1
+        current = best
+
+    return route
+
+
+@njit(cache=True)
+def two_opt(distance_matrix: np.ndarray, route: np.ndarray, max_passes: int = 20) -> np.ndarray:
+    """Mejora 2-opt in-place sobre una ruta abierta (el punto inicial queda fijo)"""
+    n = route.shape[0]
+    if n < 3:
+        return route
+
+    improved = True
+    passes = 0
+    while improved and passes < max_passes:
+        improved = False
+        passes += 1
+        for i in range(1, n - 1):
+            for j in range(i + 1, n):
+                a = route[i - 1]
+                b = route[i]
+                c = route[j]
+                old_cost = distance_matrix[a, b]
+                new_cost = distance_matrix[a, c]
+                if j < n - 1:
+                    d = route[j + 1]
+                    old_cost += distance_matrix[c, d]
+                    new_cost += distance_matrix[b, d]
+                if new_cost + 1e-10 < old_cost:
+                    left = i
+                    right = j
+                    while left < right:
+                        tmp = route[left]
+                        route[left] = route[right]
+                        route[right] = tmp
+                        left += 1
+                        right -= 1
+                    improved = True
+
+    return route
+
+
+def haversine_km_array(lat1, lon1, lat2, lon2):
+    """Versión vectorizada de haversine para arrays NumPy"""
+    phi1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    phi2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    dphi = phi2 - phi1
+    dlmb = np.radians(np.asarray(lon2, dtype=np.float64) - np.asarray(lon1, dtype=np.float64))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
@@ -1,69 +1,162 @@
 """Módulo para generación de outputs JSON para aplicaciones móviles"""
 
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict
+from typing import Dict, List
 
 def get_route_calculator():
-    """Helper function para obtener el route calculator"""
-    from src.real_routing import RealRouteCalculator
-    return RealRouteCalculator()
+    """Helper function para obtener el route calculator (singleton compartido)"""
+    from src.real_routing import get_route_calculator as _shared
+    return _shared()
+
+# Hora de salida constante: parseada una sola vez a nivel de módulo
+_DEPARTURE = datetime(1900, 1, 1, 22, 30)
+_DEPARTURE_STR = "22:30"
+_DEPARTURE_MINUTES = 22 * 60 + 30
 
 class AppDataGenerator:
     """Genera los outputs JSON para las aplicaciones de pasajeros y conductores"""
     
     def __init__(self):
         self.route_calculator = get_route_calculator()
-    
+        self._passenger_index = {}
+        self._indexed_routes_id = None
+
+    @staticmethod
+    def _route_geometry(route: Dict) -> list:
+        """Resuelve la geometría de una ruta sin alocar defaults innecesarios"""
+        geometry = route.get('real_route_geometry')
+        if geometry is not None:
+            return geometry
+        return route.get('route_coordinates') or []
+
+    def _ensure_index(self, routes_data: Dict) -> Dict:
+        """Construye (una sola vez) el índice id -> (ruta, posición, pasajero)"""
+        if self._indexed_routes_id != id(routes_data):
+            index = {}
+            for route in routes_data['routes']:
+                for idx, passenger in enumerate(route['passengers']):
+                    index[str(passenger['id'])] = (route, idx, passenger)
+            self._passenger_index = index
+            self._indexed_routes_id = id(routes_data)
+        return self._passenger_index
+
     def generate_passenger_app_data(self, routes_data: Dict, passenger_id: str) -> Dict:
         """Genera datos para la app del pasajero con tiempos reales"""
-        
-        # Buscar el pasajero en las rutas
-        for route in routes_data['routes']:
-            for idx, passenger in enumerate(route['passengers']):
-                if str(passenger['id']) == str(passenger_id):
-                    # Calcular tiempo estimado real
-                    office_coords = (4.6724261, -74.1288623)
-                    passenger_coords = (passenger['lat'], passenger['lng'])
-                    
-                    # Obtener duración real
-                    duration_min, distance_km = self.route_calculator.get_route_duration_distance(
-                        office_coords, passenger_coords
-                    )
-                    
-                    # Calcular tiempos estimados
-                    departure_time = datetime.strptime("22:30", "%H:%M")
-                    estimated_arrival = departure_time + timedelta(minutes=duration_min)
-                    
-                    # Usar real_route_geometry si existe, sino route_coordinates
-                    route_geometry = route.get('real_route_geometry', route.get('route_coordinates', []))
-                    
-                    return {
-                        'passenger_info': {
-                            'id': passenger['id'],
-                            'name': passenger['name'],
-                            'pickup_location': f"Oficina: {passenger['company_address']}",
-                            'destination': f"Lat: {passenger['lat']}, Lng: {passenger['lng']}",
-                            'distance_km': round(distance_km, 1),
-                            'estimated_duration_min': round(duration_min, 1)
-                        },
-                        'trip_details': {
-                            'bus_id': route['bus_id'],
-                            'bus_plate': route['bus_plate'],
-                            'estimated_pickup_time': "22:30",
-                            'estimated_arrival_time': estimated_arrival.strftime("%H:%M"),
-                            'status': "confirmed",
-                            'position_in_route': idx + 1
-                        },
-                        'real_time_tracking': {
-                            'bus_location': None,
-                            'estimated_arrival_in_minutes': round(duration_min, 1),
-                            'next_stop': None,
-                            'route_geometry': route_geometry
-                        }
-                    }
-        
-        return {"error": "Passenger not found"}
+
+        # Buscar el pasajero con el índice precalculado (O(1) por consulta)
+        entry = self._ensure_index(routes_data).get(str(passenger_id))
+        if entry is None:
+            return {"error": "Passenger not found"}
+
+        route, idx, passenger = entry
+        return self._build_passenger_payload(route, idx, passenger)
+
+    def generate_passenger_app_data_bulk(self, routes_data: Dict, passenger_ids: List[str]) -> Dict[str, Dict]:
+        """Genera los datos de app para varios pasajeros con consultas OSRM en paralelo"""
+
+        index = self._ensure_index(routes_data)
+
+        def build_one(passenger_id):
+            entry = index.get(str(passenger_id))
+            if entry is None:
+                return str(passenger_id), {"error": "Passenger not found"}
+            route, idx, passenger = entry
+            return str(passenger_id), self._build_passenger_payload(route, idx, passenger)
+
+        # Las consultas OSRM son independientes y están limitadas por red
+        with ThreadPoolExecutor(max_workers=min(16, max(1, len(passenger_ids)))) as executor:
+            return dict(executor.map(build_one, passenger_ids))
+
+    def precompute_route_timing(self, route_info: Dict) -> None:
+        """Calcula los tramos de una ruta una sola vez y los adjunta al route_info
+
+        Ambos generadores de apps leen los arrays adjuntos, eliminando las
+        consultas OSRM duplicadas entre la app del pasajero y la del conductor.
+        """
+        if '_legs' in route_info:
+            return
+
+        office_coords = (4.6724261, -74.1288623)
+        all_coords = [office_coords] + [(p['lat'], p['lng']) for p in route_info['passengers']]
+        legs = self.route_calculator.get_leg_durations_distances(all_coords)
+
+        cumulative_duration = []
+        cumulative_distance = []
+        total_duration = 0.0
+        total_distance = 0.0
+        for duration_min, distance_km in legs:
+            total_duration += duration_min
+            total_distance += distance_km
+            cumulative_duration.append(total_duration)
+            cumulative_distance.append(total_distance)
+
+        route_info['_legs'] = legs
+        route_info['_cumulative_duration'] = cumulative_duration
+        route_info['_cumulative_distance'] = cumulative_distance
+
+    def _build_passenger_payload(self, route: Dict, idx: int, passenger: Dict) -> Dict:
+        """Construye el output de la app del pasajero para una posición en la ruta"""
+
+        if '_legs' in route:
+            # Tiempos ya precalculados para toda la ruta: cero consultas OSRM
+            duration_min = route['_cumulative_duration'][idx]
+            distance_km = route['_cumulative_distance'][idx]
+        else:
+            # Calcular tiempo estimado real
+            office_coords = (4.6724261, -74.1288623)
+            passenger_coords = (passenger['lat'], passenger['lng'])
+
+            # Obtener duración real
+            duration_min, distance_km = self.route_calculator.get_route_duration_distance(
+                office_coords, passenger_coords
+            )
+
+        # Calcular tiempos estimados
+        estimated_arrival = _DEPARTURE + timedelta(minutes=duration_min)
+
+        # Usar real_route_geometry si existe, sino route_coordinates
+        route_geometry = self._route_geometry(route)
+
+        return {
+            'passenger_info': {
+                'id': passenger['id'],
+                'name': passenger['name'],
+                'pickup_location': f"Oficina: {passenger['company_address']}",
+                'destination': f"Lat: {passenger['lat']}, Lng: {passenger['lng']}",
+                'distance_km': round(distance_km, 1),
+                'estimated_duration_min': round(duration_min, 1)
+            },
+            'trip_details': {
+                'bus_id': route['bus_id'],
+                'bus_plate': route['bus_plate'],
+                'estimated_pickup_time': _DEPARTURE_STR,
+                'estimated_arrival_time': estimated_arrival.strftime("%H:%M"),
+                'status': "confirmed",
+                'position_in_route': idx + 1
+            },
+            'real_time_tracking': {
+                'bus_location': None,
+                'estimated_arrival_in_minutes': round(duration_min, 1),
+                'next_stop': None,
+                'route_geometry': route_geometry
+            }
+        }
     
+    def generate_all_driver_apps(self, routes_data: Dict) -> List[Dict]:
+        """Genera los outputs de la app del conductor para todos los buses en paralelo
+
+        Cada ruta es independiente y su costo es la consulta OSRM, así que el
+        trabajo escala casi linealmente con el número de hilos.
+        """
+        routes = routes_data['routes']
+        if not routes:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(16, len(routes))) as executor:
+            return list(executor.map(self.generate_driver_app_data, routes))
+
     def generate_driver_app_data(self, route_info: Dict) -> Dict:
         """Genera datos para la app del conductor con información real"""
         
@@ -71,50 +164,58 @@ class AppDataGenerator:
         stops = []
         total_duration = 0
         total_distance = 0
-        
-        office_coords = (4.6724261, -74.1288623)
-        previous_coords = office_coords
-        
-        for idx, passenger in enumerate(route_info['passengers']):
-            current_coords = (passenger['lat'], passenger['lng'])
-            
-            # Calcular tiempo y distancia hasta esta parada
-            duration_min, distance_km = self.route_calculator.get_route_duration_distance(
-                previous_coords, current_coords
-            )
-            
+
+        # Reutiliza los tramos precalculados (una sola consulta OSRM por ruta)
+        self.precompute_route_timing(route_info)
+        leg_durations_distances = route_info['_legs']
+
+        # AoS -> SoA: arrays paralelos en vez de un dict-lookup por campo y parada
+        passengers = route_info['passengers']
+        n_stops = len(passengers)
+        lats = np.fromiter((p['lat'] for p in passengers), dtype=np.float64, count=n_stops)
+        lngs = np.fromiter((p['lng'] for p in passengers), dtype=np.float64, count=n_stops)
+        ids = [p['id'] for p in passengers]
+        names = [p['name'] for p in passengers]
+
+        for idx in range(n_stops):
+            duration_min, distance_km = leg_durations_distances[idx]
+
             total_duration += duration_min
             total_distance += distance_km
-            
-            # Calcular hora estimada
-            departure_time = datetime.strptime("22:30", "%H:%M")
-            estimated_time = departure_time + timedelta(minutes=total_duration)
-            
+
+            plat = lats[idx]
+            plng = lngs[idx]
+            pid = ids[idx]
+            pname = names[idx]
+
+            # Hora estimada con aritmética entera de minutos: una sola
+            # conversión a string por parada, sin datetime/strftime en el loop
+            hours, minutes = divmod(_DEPARTURE_MINUTES + int(total_duration), 60)
+            time_str = f"{hours % 24:02d}:{minutes:02d}"
+
             passengers_list.append({
                 'order': idx + 1,
-                'passenger_id': passenger['id'],
-                'name': passenger['name'],
-                'phone': f"+57 300 {passenger['id'][-7:]}",
+                'passenger_id': pid,
+                'name': pname,
+                'phone': "+57 300 %s" % pid[-7:],
                 'pickup_status': 'pending',
                 'drop_off_status': 'pending',
-                'estimated_arrival': estimated_time.strftime("%H:%M")
+                'estimated_arrival': time_str
             })
-            
+
             stops.append({
                 'stop_number': idx + 1,
-                'passenger_name': passenger['name'],
-                'address': f"Destino - Lat: {passenger['lat']}, Lng: {passenger['lng']}",
-                'coordinates': [passenger['lat'], passenger['lng']],
-                'estimated_time': estimated_time.strftime("%H:%M"),
+                'passenger_name': pname,
+                'address': "Destino - Lat: %s, Lng: %s" % (plat, plng),
+                'coordinates': [plat, plng],
+                'estimated_time': time_str,
                 'status': 'pending',
                 'duration_from_previous': round(duration_min, 1),
                 'distance_from_previous': round(distance_km, 1)
             })
-            
-            previous_coords = current_coords
-        
+
         # Usar real_route_geometry si existe, sino route_coordinates
-        route_geometry = route_info.get('real_route_geometry', route_info.get('route_coordinates', []))
+        route_geometry = self._route_geometry(route_info)
         
         return {
             'bus_info': {
@@ -127,7 +228,7 @@ class AppDataGenerator:
                 'total_stops': len(stops),
                 'estimated_duration_minutes': round(total_duration, 1),
                 'total_distance_km': round(total_distance, 1),
-                'start_time': "22:30",
+                'start_time': _DEPARTURE_STR,
                 'pickup_location': "Oficina Central - Ac. 24 #86-49",
                 'average_speed_kmh': round((total_distance / total_duration * 60) if total_duration > 0 else 0, 1)
             },
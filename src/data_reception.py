@@ -1,9 +1,12 @@
 """Recepción y validación de datos de pasajeros"""
 
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from typing import List, Dict, Tuple
 
+from src._kernels import scale_coords
+
 class DataReceptionSystem:
     """Validación y procesamiento"""
     
@@ -13,35 +16,50 @@ class DataReceptionSystem:
     
     def clean_coordinates(self, df: pd.DataFrame) -> pd.DataFrame:
         """Limpia y convierte coordenadas con formato incorrecto"""
-        df_clean = df.copy()
-        
-        def convert_coordinate(coord):
-            if isinstance(coord, str):
-                # Remover puntos y convertir a float dividiendo por 1000
-                clean_str = coord.replace('.', '')
-                if clean_str and clean_str.replace('-', '').isdigit():
-                    # Si tiene más de 2 dígitos antes del decimal, dividir
-                    if len(clean_str.replace('-', '')) > 2:
-                        # Preservar el signo negativo
-                        sign = -1 if clean_str.startswith('-') else 1
-                        clean_str = clean_str.replace('-', '')
-                        # Convertir a float y dividir por 1000 para obtener decimales correctos
-                        return sign * float(clean_str) / 1000
-                    return float(clean_str)
-            elif isinstance(coord, (int, float)):
-                # Si ya es numérico pero tiene formato incorrecto
-                if abs(coord) > 180:
-                    return coord / 1000
-            return coord
-        
-        # Limpieza a latitud y longitud
-        if 'lat' in df_clean.columns:
-            df_clean['lat'] = df_clean['lat'].apply(convert_coordinate)
-        
-        if 'lng' in df_clean.columns:
-            df_clean['lng'] = df_clean['lng'].apply(convert_coordinate)
-        
-        return df_clean
+
+        # Limpieza a latitud y longitud: assign solo copia las columnas
+        # modificadas, evitando el copy() profundo de todo el DataFrame
+        updates = {
+            col: self._clean_coordinate_column(df[col])
+            for col in ('lat', 'lng') if col in df.columns
+        }
+        return df.assign(**updates)
+
+    def _clean_coordinate_column(self, serie: pd.Series) -> pd.Series:
+        """Limpia una columna de coordenadas con operaciones vectorizadas"""
+
+        # Columna ya numérica: solo corregir magnitudes fuera de rango
+        if serie.dtype.kind in 'iuf':
+            values = serie.to_numpy(dtype=np.float64)
+            return pd.Series(np.where(np.abs(values) > 180, values / 1000.0, values),
+                             index=serie.index)
+
+        result = serie.copy()
+        str_mask = np.fromiter((isinstance(v, str) for v in serie),
+                               dtype=bool, count=len(serie))
+
+        # Valores ya numéricos dentro de una columna mixta
+        if (~str_mask).any():
+            numeric_part = pd.to_numeric(serie[~str_mask], errors='coerce')
+            result[~str_mask] = numeric_part.where(numeric_part.abs() <= 180,
+                                                   numeric_part / 1000.0)
+
+        # Cadenas: remover puntos y escalar si tienen más de 2 dígitos
+        if str_mask.any():
+            textos = serie[str_mask].astype(str)
+            stripped = textos.str.replace('.', '', regex=False)
+            digits = stripped.str.lstrip('-')
+            is_numeric_str = (digits.str.len() > 0) & digits.str.isdigit()
+
+            # Solo las cadenas puramente numéricas se convierten; el resto queda igual
+            valid_digits = digits[is_numeric_str]
+            ints = valid_digits.astype(np.int64).to_numpy()
+            signs = np.where(stripped[is_numeric_str].str.startswith('-'), -1.0, 1.0)
+            scale_mask = (valid_digits.str.len() > 2).to_numpy()
+
+            result.loc[textos.index[is_numeric_str]] = scale_coords(ints, signs, scale_mask)
+
+        return result
     
     def validate_csv_data(self, df: pd.DataFrame) -> Tuple[bool, List[str]]:
         """Valida la estructura y contenido del CSV"""
@@ -57,17 +75,20 @@ class DataReceptionSystem:
             if col in df.columns and df[col].isnull().any():
                 errors.append(f"Valores nulos encontrados en columna: {col}")
         
-        # Verificar rango de coordenadas (Colombia)
+        # Verificar rango de coordenadas (Colombia) en una sola pasada vectorizada
         if 'lat' in df.columns and 'lng' in df.columns:
-            # Convertir a numérico antes de comparar
             try:
-                lat_numeric = pd.to_numeric(df['lat'], errors='coerce')
-                lng_numeric = pd.to_numeric(df['lng'], errors='coerce')
-                
-                if not lat_numeric.between(-5, 15).all():
-                    errors.append("Latitudes fuera del rango válido para Colombia")
-                if not lng_numeric.between(-85, -65).all():
-                    errors.append("Longitudes fuera del rango válido para Colombia")
+                lat = pd.to_numeric(df['lat'], errors='coerce').to_numpy()
+                lng = pd.to_numeric(df['lng'], errors='coerce').to_numpy()
+
+                ok = (np.isfinite(lat) & np.isfinite(lng) &
+                      (lat >= -5) & (lat <= 15) & (lng >= -85) & (lng <= -65))
+                if not ok.all():
+                    bad_rows = np.nonzero(~ok)[0][:5]
+                    errors.append(
+                        f"Coordenadas fuera del rango válido para Colombia "
+                        f"(primeras filas: {bad_rows.tolist()})"
+                    )
             except Exception as e:
                 errors.append(f"Error convirtiendo coordenadas: {str(e)}")
         
@@ -79,8 +100,21 @@ class DataReceptionSystem:
         print(f"Iniciando procesamiento de datos: {self.processing_start_time}")
         
         try:
-            # Leer CSV
-            df = pd.read_csv(file_path)
+            # Leer primero solo el encabezado: si faltan columnas requeridas,
+            # usecols haría reventar a read_csv con su propio ValueError y el
+            # diagnóstico "Columnas faltantes" de validate_csv_data jamás
+            # llegaría a ejecutarse
+            header_cols = pd.read_csv(file_path, nrows=0).columns
+            usecols = [col for col in self.required_columns if col in header_cols]
+
+            # Leer CSV: solo columnas requeridas presentes y tipos de texto
+            # declarados. lat/lng se dejan a inferencia: clean_coordinates
+            # distingue los valores bien formados de las cadenas dañadas
+            df = pd.read_csv(
+                file_path,
+                usecols=usecols,
+                dtype={'id': str, 'name': str, 'company_address': str}
+            )
             print(f"Archivo leído exitosamente: {len(df)} pasajeros")
             
             # Limpiar coordenadas
@@ -92,8 +126,7 @@ class DataReceptionSystem:
             if not is_valid:
                 raise ValueError(f"Errores en los datos: {errors}")
             
-            # Limpiar y preparar datos
-            df['id'] = df['id'].astype(str)
+            # Limpiar y preparar datos (id ya se leyó como str)
             df['lat'] = pd.to_numeric(df['lat'], errors='coerce')
             df['lng'] = pd.to_numeric(df['lng'], errors='coerce')
             df = df.dropna(subset=['lat', 'lng'])
@@ -4,7 +4,8 @@
 import sys
 import os
 import time
-import json
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -22,6 +23,14 @@ from src.stats_visualization import StatsVisualizer
 def ensure_data_directory():
     os.makedirs('data', exist_ok=True)
 
+def write_json_output(data, path, pretty=True):
+    """Serializa un output JSON con orjson (escritura binaria, sin encoder Python)"""
+    option = orjson.OPT_SERIALIZE_NUMPY
+    if pretty:
+        option |= orjson.OPT_INDENT_2
+    with open(path, 'wb') as f:
+        f.write(orjson.dumps(data, option=option))
+
 def execute_night_shift_system():
     """Función principal que ejecuta todo el sistema"""
     
@@ -52,6 +61,11 @@ def execute_night_shift_system():
     print("\n 2 - OPTIMIZACIÓN")
     start_optimization = time.time()
     routes_data = route_optimizer.generate_routes(passengers_df)
+
+    # Precalcular los tramos de cada ruta una sola vez; ambas apps los reutilizan
+    for route in routes_data['routes']:
+        app_generator.precompute_route_timing(route)
+
     optimization_time = (time.time() - start_optimization) / 60
     
     print(f"Rutas generadas en {optimization_time:.2f} minutos")
@@ -76,26 +90,31 @@ def execute_night_shift_system():
     
     try:
         first_passenger_id = passengers_df.iloc[0]['id']
-        passenger_app_data = app_generator.generate_passenger_app_data(
-            routes_data, first_passenger_id
-        )
-        
-        if routes_data['routes']:
-            driver_app_data = app_generator.generate_driver_app_data(
-                routes_data['routes'][0]
+
+        # Las consultas OSRM de ambas apps y la escritura del JSON completo
+        # (que no depende de ellas) se solapan en un pool de hilos
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            # El JSON completo es para máquinas: se escribe minificado
+            complete_future = executor.submit(
+                write_json_output, routes_data, 'json/complete_routes_data.json', False
             )
-        else:
-            driver_app_data = {"error": "No routes available"}
-            
-        # Guardar outputs
-        with open('json/passenger_app_output.json', 'w', encoding='utf-8') as f:
-            json.dump(passenger_app_data, f, indent=2, ensure_ascii=False)
+            passenger_future = executor.submit(
+                app_generator.generate_passenger_app_data, routes_data, first_passenger_id
+            )
+            if routes_data['routes']:
+                driver_future = executor.submit(
+                    app_generator.generate_driver_app_data, routes_data['routes'][0]
+                )
+            else:
+                driver_future = None
 
-        with open('json/driver_app_output.json', 'w', encoding='utf-8') as f:
-            json.dump(driver_app_data, f, indent=2, ensure_ascii=False)
+            passenger_app_data = passenger_future.result()
+            driver_app_data = driver_future.result() if driver_future else {"error": "No routes available"}
+            complete_future.result()
 
-        with open('json/complete_routes_data.json', 'w', encoding='utf-8') as f:
-            json.dump(routes_data, f, indent=2, ensure_ascii=False)
+        # Guardar outputs de apps
+        write_json_output(passenger_app_data, 'json/passenger_app_output.json')
+        write_json_output(driver_app_data, 'json/driver_app_output.json')
         
         # Mostrar tiempo total de procesamiento
         total_time = processing_time + optimization_time
@@ -1,61 +1,319 @@
 """Módulo para cálculo de rutas reales usando OSRM"""
 
+import json
+import time
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter, Retry
 from typing import List, Tuple
-from geopy.distance import geodesic
+
+from src._kernels import haversine_km
+
+# Circuit breaker: tras este número de fallos consecutivos se omite OSRM
+# durante el periodo de enfriamiento y se responde con el fallback local
+_BREAKER_THRESHOLD = 5
+_BREAKER_COOLDOWN_S = 60.0
+
+# Instancia compartida: una sola sesión HTTP (y sus caches) para todo el pipeline
+_shared_calculator = None
+
+def get_route_calculator() -> "RealRouteCalculator":
+    """Devuelve el RealRouteCalculator singleton del proceso
+
+    Instanciar uno por llamada abría un pool de conexiones nuevo y
+    descartaba los caches de rutas y duraciones en cada uso.
+    """
+    global _shared_calculator
+    if _shared_calculator is None:
+        _shared_calculator = RealRouteCalculator()
+    return _shared_calculator
 
 class RealRouteCalculator:
     """Calcula rutas reales usando OSRM"""
-    
-    def __init__(self, base_url="http://router.project-osrm.org/route/v1/driving/"):
+
+    def __init__(self, base_url="http://router.project-osrm.org/route/v1/driving/",
+                 cache_file=None):
         self.base_url = base_url
-    
+        self.table_url = base_url.replace('/route/v1/', '/table/v1/')
+        self._consecutive_failures = 0
+        self._breaker_open_until = 0.0
+
+        # Sesión compartida con keep-alive: evita un handshake TCP/TLS por consulta
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=Retry(total=2, backoff_factor=0.1,
+                              status_forcelist=[502, 503, 504],
+                              allowed_methods=['GET'])
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Caches por instancia: coordenadas redondeadas a 6 decimales (~10 cm)
+        # para que puntos casi idénticos compartan la misma consulta OSRM.
+        # Son dicts con inserción explícita: solo se guardan respuestas reales
+        # de OSRM, nunca los estimados del fallback (que además se
+        # persistirían a disco vía save_cache), y el de duraciones se puede
+        # cargar/guardar entre corridas
+        self._route_coords_cache = {}
+        self._route_details_cache = {}
+        self._duration_cache = {}
+        self.cache_file = cache_file
+        if cache_file:
+            self.load_cache(cache_file)
+
+    def load_cache(self, path: str) -> None:
+        """Precarga el cache de duraciones persistido por una corrida anterior"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for key, value in json.load(f):
+                    self._duration_cache[tuple(key)] = tuple(value)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error cargando cache OSRM: {str(e)}")
+
+    def save_cache(self, path: str = None) -> None:
+        """Persiste el cache de duraciones para que la próxima corrida arranque tibia"""
+        path = path or self.cache_file
+        if not path:
+            return
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump([[list(key), list(value)]
+                           for key, value in self._duration_cache.items()], f)
+        except Exception as e:
+            print(f"Error guardando cache OSRM: {str(e)}")
+
+    def _osrm_available(self) -> bool:
+        """Indica si se puede consultar OSRM o el breaker está abierto"""
+        return time.monotonic() >= self._breaker_open_until
+
+    def _record_success(self):
+        self._consecutive_failures = 0
+
+    def _record_failure(self):
+        self._consecutive_failures += 1
+        if self._consecutive_failures > _BREAKER_THRESHOLD:
+            # Evita que un host OSRM caído serialice todo el pipeline
+            self._breaker_open_until = time.monotonic() + _BREAKER_COOLDOWN_S
+            self._consecutive_failures = 0
+            print(f"OSRM no disponible: usando fallback local por {_BREAKER_COOLDOWN_S:.0f}s")
+
+    @staticmethod
+    def _round_coordinates(coordinates: List[Tuple[float, float]]) -> Tuple[Tuple[float, float], ...]:
+        """Normaliza coordenadas a una clave hasheable de cache"""
+        return tuple((round(lat, 6), round(lng, 6)) for lat, lng in coordinates)
+
     def get_route_coordinates(self, coordinates: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
-        """Obtiene coordenadas de ruta real entre puntos"""
+        """Obtiene coordenadas de ruta real entre puntos (con cache)"""
         if len(coordinates) < 2:
             return coordinates
-        
-        try:
-            # Formatear coordenadas para OSRM
-            coords_str = ";".join([f"{lng},{lat}" for lat, lng in coordinates])
-            url = f"{self.base_url}{coords_str}?overview=full&geometries=geojson"
-            
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            if data['code'] == 'Ok' and data['routes']:
-                # Extraer geometría de la ruta
-                route_geometry = data['routes'][0]['geometry']['coordinates']
-                # Convertir de [lng, lat] a [lat, lng]
-                return [[coord[1], coord[0]] for coord in route_geometry]
-            
-        except Exception as e:
-            print(f"Error obteniendo ruta real: {str(e)}")
-        
+
+        key = self._round_coordinates(coordinates)
+        result = self._route_coords_cache.get(key)
+        if result is None:
+            result, from_osrm = self._fetch_route_coordinates(key)
+            if from_osrm:
+                if len(self._route_coords_cache) >= 1024:
+                    self._route_coords_cache.clear()
+                self._route_coords_cache[key] = result
+        return result
+
+    def _fetch_route_coordinates(self, coordinates: Tuple[Tuple[float, float], ...]) -> Tuple[List[List[float]], bool]:
+        """Consulta OSRM por la geometría de la ruta
+
+        Devuelve (geometry, from_osrm): el flag indica si la respuesta es
+        real o el fallback en línea recta, que no debe cachearse.
+        """
+        if self._osrm_available():
+            try:
+                # Formatear coordenadas para OSRM
+                coords_str = ";".join([f"{lng},{lat}" for lat, lng in coordinates])
+                url = f"{self.base_url}{coords_str}?overview=full&geometries=geojson"
+
+                response = self.session.get(url, timeout=10)
+                response.raise_for_status()
+
+                data = response.json()
+
+                if data['code'] == 'Ok' and data['routes']:
+                    self._record_success()
+                    # Extraer geometría de la ruta
+                    route_geometry = data['routes'][0]['geometry']['coordinates']
+                    # Convertir de [lng, lat] a [lat, lng]
+                    return [[coord[1], coord[0]] for coord in route_geometry], True
+
+            except Exception as e:
+                self._record_failure()
+                print(f"Error obteniendo ruta real: {str(e)}")
+
         # Fallback: línea recta si OSRM falla
-        return coordinates
+        return [list(coord) for coord in coordinates], False
     
+    def get_route_details(self, coordinates: List[Tuple[float, float]]) -> Tuple[List[List[float]], List[Tuple[float, float]]]:
+        """Obtiene geometría y tramos de la ruta en una sola consulta /route
+
+        Devuelve (geometry, legs): la polilínea en [lat, lng] y una lista de
+        (duración_min, distancia_km) por tramo consecutivo. Fusiona lo que
+        antes eran dos round-trips OSRM separados por bus.
+        """
+        if len(coordinates) < 2:
+            return [list(coord) for coord in coordinates], []
+
+        key = self._round_coordinates(coordinates)
+        result = self._route_details_cache.get(key)
+        if result is None:
+            result, from_osrm = self._fetch_route_details(key)
+            if from_osrm:
+                if len(self._route_details_cache) >= 1024:
+                    self._route_details_cache.clear()
+                self._route_details_cache[key] = result
+        return result
+
+    def _fetch_route_details(self, coordinates: Tuple[Tuple[float, float], ...]):
+        """Consulta OSRM por geometría y tramos de una ruta multi-waypoint
+
+        Devuelve ((geometry, legs), from_osrm); los estimados del fallback
+        no se cachean.
+        """
+        if self._osrm_available():
+            try:
+                coords_str = ";".join([f"{lng},{lat}" for lat, lng in coordinates])
+                url = (f"{self.base_url}{coords_str}"
+                       f"?overview=full&geometries=geojson&annotations=duration,distance&steps=false")
+
+                response = self.session.get(url, timeout=10)
+                response.raise_for_status()
+
+                data = response.json()
+
+                if data['code'] == 'Ok' and data['routes']:
+                    self._record_success()
+                    route = data['routes'][0]
+                    geometry = [[coord[1], coord[0]] for coord in route['geometry']['coordinates']]
+                    legs = [(leg['duration'] / 60, leg['distance'] / 1000) for leg in route['legs']]
+                    return (geometry, legs), True
+
+            except Exception as e:
+                self._record_failure()
+                print(f"Error obteniendo detalles de ruta: {str(e)}")
+
+        # Fallback: línea recta + tramos estimados por par
+        geometry = [list(coord) for coord in coordinates]
+        legs = [self.get_route_duration_distance(coordinates[i], coordinates[i + 1])
+                for i in range(len(coordinates) - 1)]
+        return (geometry, legs), False
+
+    def get_leg_durations_distances(self, coordinates: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+        """Obtiene duración y distancia de cada tramo consecutivo en una sola consulta"""
+        if len(coordinates) < 2:
+            return []
+
+        if self._osrm_available():
+            try:
+                coords_str = ";".join([f"{lng},{lat}" for lat, lng in coordinates])
+                url = f"{self.base_url}{coords_str}?overview=false&annotations=duration,distance&steps=false"
+
+                response = self.session.get(url, timeout=10)
+                response.raise_for_status()
+
+                data = response.json()
+
+                if data['code'] == 'Ok' and data['routes']:
+                    self._record_success()
+                    legs = data['routes'][0]['legs']
+                    # minutos, km por tramo
+                    return [(leg['duration'] / 60, leg['distance'] / 1000) for leg in legs]
+
+            except Exception as e:
+                self._record_failure()
+                print(f"Error obteniendo tramos de ruta: {str(e)}")
+
+        # Fallback: calcular cada tramo por separado
+        return [self.get_route_duration_distance(coordinates[i], coordinates[i + 1])
+                for i in range(len(coordinates) - 1)]
+
+    def get_duration_matrix(self, coordinates: List[Tuple[float, float]],
+                            sources: List[int] = None, destinations: List[int] = None):
+        """Obtiene la matriz de duraciones (minutos) en una sola consulta /table
+
+        sources/destinations permiten pedir bloques rectangulares de la matriz
+        (índices sobre coordinates), respetando el límite de coordenadas por
+        request del OSRM público. Devuelve None si OSRM no responde; el caller
+        decide el fallback.
+        """
+        n = len(coordinates)
+        if n < 2:
+            return np.zeros((n, n), dtype=np.float32)
+
+        if self._osrm_available():
+            try:
+                coords_str = ";".join([f"{lng},{lat}" for lat, lng in coordinates])
+                url = f"{self.table_url}{coords_str}?annotations=duration"
+                if sources is not None:
+                    url += "&sources=" + ";".join(str(i) for i in sources)
+                if destinations is not None:
+                    url += "&destinations=" + ";".join(str(i) for i in destinations)
+
+                response = self.session.get(url, timeout=30)
+                response.raise_for_status()
+
+                data = response.json()
+
+                if data['code'] == 'Ok' and data.get('durations'):
+                    self._record_success()
+                    # float32 basta: la matriz solo alimenta comparaciones del
+                    # TSP y a este tamaño cabe en caché con la mitad de ancho
+                    return np.asarray(data['durations'], dtype=np.float32) / np.float32(60.0)  # minutos
+
+            except Exception as e:
+                self._record_failure()
+                print(f"Error obteniendo matriz de duraciones: {str(e)}")
+
+        return None
+
     def get_route_duration_distance(self, origin: Tuple[float, float], destination: Tuple[float, float]) -> Tuple[float, float]:
-        """Obtiene duración y distancia de ruta entre dos puntos"""
-        try:
-            coords_str = f"{origin[1]},{origin[0]};{destination[1]},{destination[0]}"
-            url = f"{self.base_url}{coords_str}?overview=false"
-            
-            response = requests.get(url, timeout=5)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            if data['code'] == 'Ok' and data['routes']:
-                route = data['routes'][0]
-                return route['duration'] / 60, route['distance'] / 1000  # minutos, km
-            
-        except Exception as e:
-            print(f"Error obteniendo duración de ruta: {str(e)}")
-        
-        # Fallback: calcular distancia geodésica
-        distance_km = geodesic(origin, destination).kilometers
+        """Obtiene duración y distancia de ruta entre dos puntos (con cache)"""
+        (olat, olng), (dlat, dlng) = self._round_coordinates([origin, destination])
+        key = (olat, olng, dlat, dlng)
+
+        result = self._duration_cache.get(key)
+        if result is None:
+            result, from_osrm = self._fetch_route_duration_distance((olat, olng), (dlat, dlng))
+            # Solo cachear respuestas reales: un estimado haversine cacheado
+            # (y persistido por save_cache) sobreviviría a la caída de OSRM
+            if from_osrm:
+                if len(self._duration_cache) >= 200000:
+                    self._duration_cache.clear()
+                self._duration_cache[key] = result
+        return result
+
+    def _fetch_route_duration_distance(self, origin: Tuple[float, float], destination: Tuple[float, float]) -> Tuple[Tuple[float, float], bool]:
+        """Consulta OSRM por duración y distancia entre dos puntos
+
+        Devuelve ((minutos, km), from_osrm); el fallback no debe cachearse.
+        """
+        if self._osrm_available():
+            try:
+                coords_str = f"{origin[1]},{origin[0]};{destination[1]},{destination[0]}"
+                url = f"{self.base_url}{coords_str}?overview=false"
+
+                response = self.session.get(url, timeout=5)
+                response.raise_for_status()
+
+                data = response.json()
+
+                if data['code'] == 'Ok' and data['routes']:
+                    self._record_success()
+                    route = data['routes'][0]
+                    return (route['duration'] / 60, route['distance'] / 1000), True  # minutos, km
+
+            except Exception as e:
+                self._record_failure()
+                print(f"Error obteniendo duración de ruta: {str(e)}")
+
+        # Fallback: calcular distancia haversine (sin red, ~20 FLOPs)
+        distance_km = haversine_km(origin[0], origin[1], destination[0], destination[1])
         duration_min = (distance_km / 25) * 60  # Asumiendo 25 km/h promedio
-        return duration_min, distance_km
\ No newline at end of file
+        return (duration_min, distance_km), False
\ No newline at end of file
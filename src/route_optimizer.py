@@ -1,47 +1,75 @@
 """Módulo de optimización de rutas usando clustering y TSP"""
 
+import bisect
+from operator import itemgetter
+
 import pandas as pd
 import numpy as np
-from sklearn.cluster import DBSCAN, KMeans
-from geopy.distance import geodesic
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.cluster import DBSCAN, MiniBatchKMeans
 from typing import List, Dict
 from datetime import datetime
 
+from scipy.spatial.distance import pdist, squareform
+
+from src._kernels import EARTH_RADIUS_KM, HAVE_NUMBA, haversine_matrix, nn_route, two_opt
+
 def get_route_calculator():
-    """Helper function para obtener el route calculator"""
-    from src.real_routing import RealRouteCalculator
-    return RealRouteCalculator()
+    """Helper function para obtener el route calculator (singleton compartido)"""
+    from src.real_routing import get_route_calculator as _shared
+    return _shared()
 
 class RouteOptimizer:
     """Optimización de rutas usando clustering y TSP"""
     
+    # El OSRM público rechaza consultas /table de más de ~100 ubicaciones.
+    # Un bloque rectangular envía filas + columnas, así que con 50 el peor
+    # caso (bloque fuera de la diagonal) manda 50 + 50 = 100 coordenadas
+    _TABLE_BLOCK_SIZE = 50
+
     def __init__(self, bus_capacities=[8, 15, 19, 20, 40]):
         self.bus_capacities = sorted(bus_capacities, reverse=True)
+        # Copia ascendente para búsqueda binaria del bus más chico que alcanza
+        self._caps_asc = sorted(bus_capacities)
         self.routes = []
         self.buses_needed = []
+        self._full_time_matrix = None
+        self._idx_map = {}
     
+    @staticmethod
+    def _project_to_plane(coords_deg: np.ndarray) -> np.ndarray:
+        """Proyección equirectangular a km alrededor del centroide
+
+        Para clusters a escala de ciudad el error de ángulo pequeño frente a
+        haversine es despreciable y permite usar distancia euclidiana compilada.
+        """
+        rad = np.radians(coords_deg)
+        lat0 = rad[:, 0].mean()
+        xy = np.empty_like(rad)
+        xy[:, 0] = EARTH_RADIUS_KM * np.cos(lat0) * rad[:, 1]
+        xy[:, 1] = EARTH_RADIUS_KM * rad[:, 0]
+        return xy
+
     def calculate_distance_matrix(self, passengers: pd.DataFrame) -> np.ndarray:
         """Calcula matriz de distancias entre todos los puntos"""
-        coords = passengers[['lat', 'lng']].values
-        n = len(coords)
-        distance_matrix = np.zeros((n, n))
-        
-        for i in range(n):
-            for j in range(i+1, n):
-                dist = geodesic(coords[i], coords[j]).kilometers
-                distance_matrix[i][j] = dist
-                distance_matrix[j][i] = dist
-        
-        return distance_matrix
+        xy = self._project_to_plane(passengers[['lat', 'lng']].to_numpy())
+        return squareform(pdist(xy, 'euclidean'))
     
     def calculate_real_distance_matrix(self, passengers: pd.DataFrame) -> np.ndarray:
         """Calcula matriz de tiempos de viaje reales entre puntos"""
         route_calculator = get_route_calculator()
-        
+
         coords = passengers[['lat', 'lng']].values
         n = len(coords)
-        time_matrix = np.zeros((n, n))
-        
+
+        # Una sola consulta /table en lugar de O(n^2) round-trips
+        matrix = route_calculator.get_duration_matrix([(c[0], c[1]) for c in coords])
+        if matrix is not None:
+            return matrix
+
+        # Fallback: consultas por par (relleno simétrico)
+        time_matrix = np.zeros((n, n), dtype=np.float32)
+
         for i in range(n):
             for j in range(i+1, n):
                 origin = (coords[i][0], coords[i][1])
@@ -52,19 +80,72 @@ class RouteOptimizer:
         
         return time_matrix
     
+    def _build_full_time_matrix(self, passengers: pd.DataFrame) -> None:
+        """Construye una sola vez la matriz global de tiempos entre pasajeros
+
+        Cada bus obtiene luego su submatriz con np.ix_, en lugar de pagar una
+        consulta OSRM separada por subconjunto. Para más pasajeros que el
+        límite del endpoint /table, la matriz se arma por bloques.
+        """
+        coords_arr = passengers[['lat', 'lng']].to_numpy()
+        coords = [(c[0], c[1]) for c in coords_arr]
+        n = len(coords)
+        route_calculator = get_route_calculator()
+        block = self._TABLE_BLOCK_SIZE
+
+        # La matriz completa cabe en una consulta mientras n no exceda el
+        # límite de ubicaciones (2 bloques: el mismo tope que un bloque
+        # rectangular de filas + columnas)
+        if n <= 2 * block:
+            matrix = route_calculator.get_duration_matrix(coords)
+        else:
+            matrix = np.zeros((n, n), dtype=np.float32)
+            for i0 in range(0, n, block):
+                if matrix is None:
+                    break
+                rows = list(range(i0, min(i0 + block, n)))
+                for j0 in range(0, n, block):
+                    cols = list(range(j0, min(j0 + block, n)))
+                    subset = list(dict.fromkeys(rows + cols))
+                    pos = {global_idx: k for k, global_idx in enumerate(subset)}
+                    sub = route_calculator.get_duration_matrix(
+                        [coords[g] for g in subset],
+                        sources=[pos[g] for g in rows],
+                        destinations=[pos[g] for g in cols]
+                    )
+                    if sub is None:
+                        matrix = None
+                        break
+                    matrix[np.ix_(rows, cols)] = sub
+
+        if matrix is None:
+            # Fallback sin red: estimación haversine a 25 km/h promedio
+            matrix = (haversine_matrix(coords_arr[:, 0], coords_arr[:, 1]) / 25.0 * 60.0).astype(np.float32)
+
+        self._full_time_matrix = matrix
+        self._idx_map = {str(passenger_id): i for i, passenger_id in enumerate(passengers['id'])}
+
     def get_real_route_coordinates(self, passengers: pd.DataFrame) -> List[List[float]]:
         """Obtiene coordenadas de ruta real incluyendo la oficina"""
         route_calculator = get_route_calculator()
-        
+
         office_coords = (4.6724261, -74.1288623)
-        
+
         # Crear lista de coordenadas: oficina + pasajeros en orden
         all_coords = [office_coords]
         for _, passenger in passengers.iterrows():
             all_coords.append((passenger['lat'], passenger['lng']))
-        
+
         # Obtener ruta real
         return route_calculator.get_route_coordinates(all_coords)
+
+    def get_real_route_details(self, passengers: pd.DataFrame):
+        """Obtiene geometría y tramos de la ruta (oficina + pasajeros) en una consulta"""
+        route_calculator = get_route_calculator()
+
+        office_coords = (4.6724261, -74.1288623)
+        all_coords = [office_coords] + list(zip(passengers['lat'], passengers['lng']))
+        return route_calculator.get_route_details(all_coords)
     
     def cluster_passengers(self, passengers: pd.DataFrame, method='kmeans') -> pd.DataFrame:
         """Agrupa pasajeros por proximidad geográfica"""
@@ -72,16 +153,30 @@ class RouteOptimizer:
         # Estimar número de clusters basado en capacidad de buses
         total_passengers = len(passengers)
         estimated_clusters = max(1, total_passengers // 20)
-        
-        coords = passengers[['lat', 'lng']].values
-        
+
+        # Turnos triviales: si todos caben en el bus más grande (o solo habría
+        # un cluster), no hay nada que separar y el init de KMeans/DBSCAN sobra
+        if total_passengers <= max(self.bus_capacities) or estimated_clusters == 1:
+            passengers['cluster'] = 0
+            return passengers
+
+        coords = passengers[['lat', 'lng']].to_numpy()
+
         if method == 'kmeans':
-            clustering = KMeans(n_clusters=min(estimated_clusters, total_passengers), 
-                              random_state=42, n_init=10)
+            # MiniBatchKMeans con pocas inicializaciones: para k pequeño en 2D
+            # los 10 reinicios completos de Lloyd eran un desperdicio.
+            # Se clusteriza sobre la proyección en km para que la distancia
+            # euclidiana tenga sentido físico
+            clustering = MiniBatchKMeans(n_clusters=min(estimated_clusters, total_passengers),
+                                         batch_size=256, n_init=3, random_state=42)
+            features = self._project_to_plane(coords)
         else:
-            clustering = DBSCAN(eps=0.01, min_samples=2)
-        
-        passengers['cluster'] = clustering.fit_predict(coords)
+            # ball_tree + haversine usa un índice de vecinos compilado
+            clustering = DBSCAN(eps=np.radians(0.01), min_samples=2,
+                                algorithm='ball_tree', metric='haversine')
+            features = np.radians(coords)
+
+        passengers['cluster'] = clustering.fit_predict(features)
         
         # Si DBSCAN genera clusters con -1 (ruido), asignarlos a clusters individuales
         if method == 'dbscan':
@@ -99,50 +194,137 @@ class RouteOptimizer:
         
         for cluster_id, cluster_passengers in passengers_by_cluster.items():
             cluster_size = len(cluster_passengers)
-            
-            # Algoritmo greedy para asignar vehículos
+
+            # Algoritmo greedy para asignar vehículos. Los pasajeros se mantienen
+            # como slices columnares del DataFrame; la conversión a dicts se
+            # difiere hasta armar el route_info final
             buses_for_cluster = []
+            offset = 0
             remaining_passengers = cluster_size
-            
+
             for capacity in self.bus_capacities:
                 while remaining_passengers >= capacity:
                     buses_for_cluster.append({
                         'capacity': capacity,
                         'passengers_count': capacity,
-                        'passengers': cluster_passengers.iloc[:capacity].to_dict('records')
+                        'passengers': cluster_passengers.iloc[offset:offset + capacity]
                     })
-                    cluster_passengers = cluster_passengers.iloc[capacity:]
+                    offset += capacity
                     remaining_passengers -= capacity
-            
-            # Asignar pasajeros restantes al bus más pequeño disponible
+
+            # Asignar pasajeros restantes al bus más pequeño disponible:
+            # bisect sobre la lista ascendente en vez de filtrar + min()
             if remaining_passengers > 0:
-                suitable_capacity = min([cap for cap in self.bus_capacities if cap >= remaining_passengers])
+                suitable_capacity = self._caps_asc[bisect.bisect_left(self._caps_asc, remaining_passengers)]
                 buses_for_cluster.append({
                     'capacity': suitable_capacity,
                     'passengers_count': remaining_passengers,
-                    'passengers': cluster_passengers.to_dict('records')
+                    'passengers': cluster_passengers.iloc[offset:]
                 })
-            
+
             assignments.extend(buses_for_cluster)
         
         return assignments
     
     def solve_tsp_greedy(self, distance_matrix: np.ndarray, start_idx: int = 0) -> List[int]:
         """Resuelve TSP usando algoritmo greedy (nearest neighbor)"""
+        distance_matrix = np.asarray(distance_matrix)
         n = len(distance_matrix)
-        unvisited = set(range(n))
+
+        # Con numba disponible, NN + 2-opt corren como código nativo compilado
+        if HAVE_NUMBA:
+            route = nn_route(distance_matrix, start_idx)
+            return [int(i) for i in two_opt(distance_matrix, route)]
+
+        # Argmin vectorizado sobre los no visitados en lugar de min() con lambda
+        visited = np.zeros(n, dtype=bool)
+        visited[start_idx] = True
+        route = [start_idx]
         current = start_idx
-        route = [current]
-        unvisited.remove(current)
-        
-        while unvisited:
-            nearest = min(unvisited, key=lambda x: distance_matrix[current][x])
+
+        for _ in range(n - 1):
+            row = distance_matrix[current].copy()
+            row[visited] = np.inf
+            nearest = int(row.argmin())
             route.append(nearest)
+            visited[nearest] = True
             current = nearest
-            unvisited.remove(nearest)
-        
+
+        # Nearest neighbor puede quedar >10% por encima del óptimo: pulir con 2-opt
+        return self._two_opt(route, distance_matrix)
+
+    def _two_opt(self, route: List[int], distance_matrix: np.ndarray,
+                 max_passes: int = 20) -> List[int]:
+        """Mejora local 2-opt: revierte segmentos mientras acorten la ruta abierta"""
+        route = list(route)
+        n = len(route)
+        if n < 3:
+            return route
+
+        improved = True
+        passes = 0
+        while improved and passes < max_passes:
+            improved = False
+            passes += 1
+            for i in range(1, n - 1):
+                for j in range(i + 1, n):
+                    a, b = route[i - 1], route[i]
+                    c = route[j]
+                    old_cost = distance_matrix[a, b]
+                    new_cost = distance_matrix[a, c]
+                    if j < n - 1:
+                        d = route[j + 1]
+                        old_cost += distance_matrix[c, d]
+                        new_cost += distance_matrix[b, d]
+                    if new_cost + 1e-10 < old_cost:
+                        route[i:j + 1] = route[i:j + 1][::-1]
+                        improved = True
+
         return route
     
+    def _process_one_bus(self, assignment: Dict) -> Dict:
+        """Resuelve el TSP y consulta la ruta de un bus; devuelve su route_info
+
+        El bus_id/bus_plate se asignan después del gather para que los IDs
+        sean deterministas independientemente del orden de terminación.
+        """
+        # El assignment ya trae un slice columnar del DataFrame
+        bus_passengers = assignment['passengers']
+
+        if len(bus_passengers) > 1:
+            # Submatriz de tiempos del bus, sin consultas OSRM extra
+            local_idx = [self._idx_map[str(pid)] for pid in bus_passengers['id']]
+            distance_matrix = self._full_time_matrix[np.ix_(local_idx, local_idx)]
+
+            # Resolver TSP
+            optimal_route = self.solve_tsp_greedy(distance_matrix)
+
+            # Reordenar pasajeros según ruta óptima
+            ordered_passengers = bus_passengers.iloc[optimal_route]
+        else:
+            # Para un solo pasajero, ruta directa desde oficina
+            ordered_passengers = bus_passengers
+
+        # Una sola consulta /route devuelve geometría y tramos
+        route_coords, legs = self.get_real_route_details(ordered_passengers)
+
+        route_info = {
+            'capacity': assignment['capacity'],
+            'passengers_count': assignment['passengers_count'],
+            'passengers': ordered_passengers.to_dict('records'),
+            'route_coordinates': route_coords,
+            'real_route_geometry': route_coords
+        }
+
+        # Tramos ya resueltos por la misma consulta: los generadores de
+        # apps los reutilizan sin volver a tocar OSRM
+        if legs:
+            route_info['_legs'] = legs
+            route_info['_cumulative_duration'] = list(np.cumsum([d for d, _ in legs]))
+            route_info['_cumulative_distance'] = list(np.cumsum([km for _, km in legs]))
+
+        return route_info
+
     def generate_routes(self, passengers: pd.DataFrame) -> Dict:
         """Genera rutas optimizadas para todos los pasajeros"""
         
@@ -157,53 +339,25 @@ class RouteOptimizer:
                     passengers_clustered['cluster'] == cluster_id
                 ].reset_index(drop=True)
             
-            # 3. Asignar vehículos
+            # 3. Matriz global de tiempos: una sola ronda de consultas /table
+            self._build_full_time_matrix(passengers_clustered)
+
+            # 4. Asignar vehículos
             vehicle_assignments = self.optimize_vehicle_assignment(clusters)
             
-            # 4. Generar rutas TSP para cada bus
-            routes_data = []
-            bus_counter = 1
-            
-            for assignment in vehicle_assignments:
-                if len(assignment['passengers']) > 1:
-                    # Crear dataframe temporal para este bus
-                    bus_passengers = pd.DataFrame(assignment['passengers'])
-                    
-                    # Calcular matriz de distancias con tiempos reales
-                    distance_matrix = self.calculate_real_distance_matrix(bus_passengers)
-                    
-                    # Resolver TSP
-                    optimal_route = self.solve_tsp_greedy(distance_matrix)
-                    
-                    # Reordenar pasajeros según ruta óptima
-                    ordered_passengers = bus_passengers.iloc[optimal_route]
-                    
-                    # Obtener ruta real con OSRM
-                    route_coords = self.get_real_route_coordinates(ordered_passengers)
-                    
-                else:
-                    ordered_passengers = pd.DataFrame(assignment['passengers'])
-                    # Para un solo pasajero, ruta directa desde oficina
-                    office_coords = (4.6724261, -74.1288623)
-                    passenger_coords = (ordered_passengers.iloc[0]['lat'], ordered_passengers.iloc[0]['lng'])
-                    route_coords = get_route_calculator().get_route_coordinates([office_coords, passenger_coords])
-                
-                route_info = {
-                    'bus_id': f"BUS-{bus_counter:03d}",
-                    'bus_plate': f"ABC-{bus_counter:03d}",
-                    'capacity': assignment['capacity'],
-                    'passengers_count': assignment['passengers_count'],
-                    'passengers': ordered_passengers.to_dict('records'),
-                    'route_coordinates': route_coords,
-                    'real_route_geometry': route_coords
-                }
-                
-                routes_data.append(route_info)
-                bus_counter += 1
+            # 5. TSP + consulta de ruta por bus en paralelo: cada bus es
+            # independiente y el costo dominante (OSRM, NumPy) suelta el GIL
+            with ThreadPoolExecutor(max_workers=min(16, max(1, len(vehicle_assignments)))) as executor:
+                routes_data = list(executor.map(self._process_one_bus, vehicle_assignments))
+
+            # IDs deterministas asignados después del gather, en orden de assignment
+            for bus_counter, route_info in enumerate(routes_data, start=1):
+                route_info['bus_id'] = f"BUS-{bus_counter:03d}"
+                route_info['bus_plate'] = f"ABC-{bus_counter:03d}"
             
-            # Calcular estadísticas
+            # Calcular estadísticas: itemgetter despacha el lookup en C
             total_buses = len(routes_data)
-            total_capacity = sum([route['capacity'] for route in routes_data])
+            total_capacity = sum(map(itemgetter('capacity'), routes_data))
             utilization = len(passengers) / total_capacity if total_capacity > 0 else 0
             
             return {
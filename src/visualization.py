@@ -1,115 +1,84 @@
 """Módulo para visualización de rutas con Folium"""
 
 import folium
-from typing import Dict
+from folium.plugins import FastMarkerCluster
+from itertools import cycle, islice
+from typing import Dict, List
+import gzip
+import hashlib
+import json
+import math
 import os
 from datetime import datetime
 
-class RouteVisualizer:
-    """Visualizar las rutas usando Folium"""
-    
-    def __init__(self, center_lat=4.6724261, center_lng=-74.1288623):
-        self.center_lat = center_lat
-        self.center_lng = center_lng
-        self.colors = ['red', 'blue', 'green', 'purple', 'orange', 'darkred', 
-                      'darkorange', 'darkgray', 'darkblue', 'darkgreen', 'cadetblue', 
-                      'darkpurple', 'black', 'pink', 'lightblue', 'lightgreen', 'gray'
-        ]
-    
-    def ensure_img_directory(self):
-        os.makedirs('img', exist_ok=True)
-    
-    def create_route_map(self, routes_data: Dict, save_path: str = None) -> folium.Map:
-        
-        # img existe
-        self.ensure_img_directory()
-        
-        # Mapa centrado en Bogotá
-        m = folium.Map(
-            location=[self.center_lat, self.center_lng],
-            zoom_start=12,
-            tiles='OpenStreetMap'
-        )
-        
-        # Punto de origen
-        folium.Marker(
-            [self.center_lat, self.center_lng],
-            popup=f"Oficina<br>Ac. 24 #86-49, Bogotá",
-            tooltip="Punto de Partida",
-            icon=folium.Icon(color='black', icon='building')
-        ).add_to(m)
-        
-        # Rutas
-        for idx, route in enumerate(routes_data['routes']):
-            color = self.colors[idx % len(self.colors)]
-            
-            # Marcadores para cada pasajero
-            for passenger_idx, passenger in enumerate(route['passengers']):
-                folium.Marker(
-                    [passenger['lat'], passenger['lng']],
-                    popup=f"🚌 {route['bus_id']}<br>"
-                        f"👤 {passenger['name']}<br>"
-                        f"📍 Parada #{passenger_idx + 1}",
-                    tooltip=f"{passenger['name']} - {route['bus_id']}",
-                    icon=folium.Icon(
-                        color=color,
-                        icon_color='white',
-                        icon='user',
-                        prefix='fa')
-                ).add_to(m)
-            
-            route_coords = []
-            
-            # Recorrido si existe, sino route_coordinates
-            route_coords = route.get('real_route_geometry', route.get('route_coordinates', []))
-            if len(route_coords) > 1:
-                folium.PolyLine(
-                    locations=route_coords,
-                    weight=3,
-                    color=color,
-                    opacity=0.9,
-                    popup=f"Ruta {route['bus_id']} - {route['passengers_count']} pasajeros"
-                ).add_to(m)
-            
-        # Agregar leyenda
-        legend_html = self._create_legend(routes_data)
-        m.get_root().html.add_child(folium.Element(legend_html))
-        
-        if save_path:
-            m.save(save_path)
-            print(f"Mapa guardado en: {save_path}")
-        
-        return m
-    
-    def _create_legend(self, routes_data: Dict) -> str:
-        """Leyenda o convenciones"""
-        legend_items = []
-        for idx, route in enumerate(routes_data['routes']):
-            color = self.colors[idx % len(self.colors)]
-            efficiency = (route['passengers_count'] / route['capacity']) * 100
-            legend_items.append(f"""
-                <tr>
-                    <td><span style="color:{color}; font-size: 16px;">●</span></td>
-                    <td>{route['bus_id']}</td>
-                    <td>{route['passengers_count']}/{route['capacity']}</td>
-                    <td>{efficiency:.1f}%</td>
-                </tr>
-            """)
-        
-        # Métricas dashboard
-        total_buses = routes_data['summary']['total_buses']
-        total_passengers = routes_data['summary']['total_passengers']
-        utilization = routes_data['summary']['utilization_rate'] * 100
-        total_capacity = sum(route['capacity'] for route in routes_data['routes'])
-        empty_seats = total_capacity - total_passengers
-        
-        return f"""
-        <div style="position: fixed; 
-                    top: 10px; right: 10px; width: 380px; height: auto; 
-                    background-color: white; border:2px solid #2c3e50; z-index:9999; 
+
+def _simplify_polyline(coords: List, epsilon: float = 1e-4) -> List:
+    """Douglas–Peucker iterativo sobre pares [lat, lng] en grados
+
+    Las geometrías de OSRM traen miles de puntos casi colineales; con
+    epsilon=1e-4 (~11 m) se descarta la mayoría sin cambio visible y el
+    HTML del mapa se encoge en proporción. Implementación propia para no
+    sumar una dependencia por una sola función.
+    """
+    n = len(coords)
+    if n <= 2:
+        return list(coords)
+
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+
+    while stack:
+        start, end = stack.pop()
+        ax, ay = coords[start][0], coords[start][1]
+        bx, by = coords[end][0], coords[end][1]
+        dx, dy = bx - ax, by - ay
+        seg_len = math.hypot(dx, dy)
+
+        max_dist = 0.0
+        max_idx = -1
+        for i in range(start + 1, end):
+            px, py = coords[i][0], coords[i][1]
+            if seg_len == 0.0:
+                dist = math.hypot(px - ax, py - ay)
+            else:
+                # Distancia perpendicular al segmento vía producto cruz
+                dist = abs(dx * (ay - py) - dy * (ax - px)) / seg_len
+            if dist > max_dist:
+                max_dist = dist
+                max_idx = i
+
+        if max_dist > epsilon:
+            keep[max_idx] = True
+            stack.append((start, max_idx))
+            stack.append((max_idx, end))
+
+    return [coords[i] for i in range(n) if keep[i]]
+
+# Callback JS para FastMarkerCluster: un solo array de datos en el HTML en
+# lugar de un objeto Marker serializado por pasajero. circleMarker dibuja un
+# <circle> directo, sin el DivIcon + FontAwesome que cargaba cada AwesomeMarker
+_MARKER_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+        radius: 6, color: row[4], weight: 1,
+        fill: true, fillColor: row[4], fillOpacity: 0.9
+    });
+    marker.bindPopup(row[2]);
+    marker.bindTooltip(row[3]);
+    return marker;
+};
+"""
+
+# Bloques estáticos de la leyenda: construidos una sola vez al importar,
+# _create_legend solo intercala las partes dinámicas entre ellos
+_LEGEND_HEADER = """
+        <div style="position: fixed;
+                    top: 10px; right: 10px; width: 380px; height: auto;
+                    background-color: white; border:2px solid #2c3e50; z-index:9999;
                     font-size:12px; padding: 15px; border-radius: 10px;
                     box-shadow: 0 4px 8px rgba(0,0,0,0.2);">
-        
+
         <!-- Header -->
         <div style="display: flex; align-items: center; margin-bottom: 15px; border-bottom: 2px solid #ecf0f1; padding-bottom: 10px;">
             <img src="img/logo.svg" alt="Bas Logo" style="width: 40px; height: 40px; margin-right: 10px;">
@@ -137,7 +106,26 @@ class RouteVisualizer:
                     </tr>
                 </thead>
                 <tbody>
-                    {''.join(legend_items)}
+"""
+
+# Templates pre-parseados una sola vez: .format solo rellena los huecos
+_POPUP_TMPL = "🚌 {bus}<br>👤 {name}<br>📍 Parada #{n}"
+_TOOLTIP_TMPL = "{name} - {bus}"
+
+# Formato %: el camino C de str.__mod__ es más barato que __format__ por fila
+_ROW_TMPL = ('<tr><td><span style="color:%s; font-size: 16px;">●</span></td>'
+             '<td>%s</td>'
+             '<td>%d/%d</td>'
+             '<td>%.1f%%</td></tr>')
+
+def _legend_row(item) -> str:
+    """Renderiza una fila de la leyenda desde una tupla de _prepare_route_meta"""
+    color, efficiency, route = item
+    return _ROW_TMPL % (color, route['bus_id'], route['passengers_count'],
+                        route['capacity'], efficiency)
+
+
+_LEGEND_STATS = """
                 </tbody>
             </table>
         </div>
@@ -179,7 +167,7 @@ class RouteVisualizer:
                     </div>
                     <div style="display: flex; justify-content: space-between;">
                         <span>Promedio Pasajeros/Bus:</span>
-                        <span style="font-weight: bold;">{(total_passengers/total_buses):.1f}</span>
+                        <span style="font-weight: bold;">{avg_passengers:.1f}</span>
                     </div>
                 </div>
             </div>
@@ -189,17 +177,227 @@ class RouteVisualizer:
 
         <!-- Footer -->
         <div style="font-size: 11px; color: #7f8c8d; text-align: center;">
-            <div>Última actualización - {datetime.now().strftime('%H:%M')}</div>
+            <div>Última actualización - {timestamp}</div>
         </div>
+"""
 
+_LEGEND_FOOTER = """
         <!-- JavaScript -->
         <script>
-            function showTab(tabId) {{
+            function showTab(tabId) {
                 document.getElementById('tab-routes').style.display = 'none';
                 document.getElementById('tab-stats').style.display = 'none';
                 document.getElementById(tabId).style.display = 'block';
-            }}
+            }
         </script>
 
         </div>
-        """
\ No newline at end of file
+        """
+
+class RouteVisualizer:
+    """Visualizar las rutas usando Folium"""
+
+    # Sin __dict__ por instancia: los atributos son fijos y conocidos
+    __slots__ = ('center_lat', 'center_lng', 'colors', 'tiles', 'tiles_attr')
+
+    def __init__(self, center_lat=4.6724261, center_lng=-74.1288623,
+                 tiles='OpenStreetMap', tiles_attr=None):
+        self.center_lat = center_lat
+        self.center_lng = center_lng
+        # tiles acepta un nombre folium o un template URL {z}/{x}/{y} (p. ej.
+        # un servidor de teselas vectoriales o MBTiles local); tiles_attr es
+        # la atribución requerida cuando se usa un template propio
+        self.tiles = tiles
+        self.tiles_attr = tiles_attr
+        self.colors = ['red', 'blue', 'green', 'purple', 'orange', 'darkred', 
+                      'darkorange', 'darkgray', 'darkblue', 'darkgreen', 'cadetblue', 
+                      'darkpurple', 'black', 'pink', 'lightblue', 'lightgreen', 'gray'
+        ]
+    
+    # Memo a nivel de clase: el mkdir/stat se paga una sola vez por proceso
+    _img_dir_ok = False
+
+    def ensure_img_directory(self):
+        if not RouteVisualizer._img_dir_ok:
+            os.makedirs('img', exist_ok=True)
+            RouteVisualizer._img_dir_ok = True
+
+    def _route_colors(self, n: int) -> List[str]:
+        """Precalcula el color de cada ruta en un solo paso por la rueda de colores"""
+        return list(islice(cycle(self.colors), n))
+
+    def _prepare_route_meta(self, routes_data: Dict):
+        """Una sola pasada por las rutas, compartida entre mapa y leyenda
+
+        Devuelve (meta, total_capacity) con meta = [(color, eficiencia_%, ruta)];
+        evita recomputar colores y ocupación en cada consumidor.
+        """
+        routes = routes_data['routes']
+        meta = []
+        total_capacity = 0
+        for route, color in zip(routes, self._route_colors(len(routes))):
+            total_capacity += route['capacity']
+            meta.append((color, (route['passengers_count'] / route['capacity']) * 100.0, route))
+        return meta, total_capacity
+    
+    def create_route_map(self, routes_data: Dict, save_path: str = None,
+                         as_of: datetime = None, content_hash: bool = False) -> folium.Map:
+
+        # content_hash inserta un digest del payload en el nombre del archivo:
+        # si las rutas no cambiaron, el HTML ya existe y el render se omite
+        # por completo (el nombre estable también habilita caching HTTP/CDN)
+        if save_path and content_hash and save_path.endswith('.html'):
+            digest = hashlib.blake2b(
+                json.dumps(routes_data, sort_keys=True, separators=(',', ':'),
+                           default=str).encode(),
+                digest_size=8
+            ).hexdigest()
+            save_path = f"{save_path[:-5]}-{digest}.html"
+            if os.path.exists(save_path) and os.path.getsize(save_path) > 0:
+                print(f"Mapa sin cambios, reutilizando: {save_path}")
+                return None
+
+        # img existe (solo importa si se va a guardar; el logo vive ahí)
+        if save_path:
+            self.ensure_img_directory()
+
+        # Mapa centrado en Bogotá
+        # prefer_canvas: Leaflet rasteriza polilíneas y círculos en un canvas
+        # en vez de un nodo SVG por vértice; el costo pasa a ser proporcional
+        # a los píxeles visibles y no al número de puntos de las rutas
+        m = folium.Map(
+            location=[self.center_lat, self.center_lng],
+            zoom_start=12,
+            tiles=self.tiles,
+            attr=self.tiles_attr,
+            prefer_canvas=True
+        )
+        
+        # Punto de origen
+        folium.Marker(
+            [self.center_lat, self.center_lng],
+            popup=f"Oficina<br>Ac. 24 #86-49, Bogotá",
+            tooltip="Punto de Partida",
+            icon=folium.Icon(color='black', icon='building')
+        ).add_to(m)
+        
+        # Rutas: los marcadores de todos los pasajeros se acumulan en un solo
+        # array y se renderizan con FastMarkerCluster (quadtree del lado del
+        # browser), en vez de un folium.Marker con su popup HTML por persona
+        marker_data = []
+        route_features = []
+        route_meta, total_capacity = self._prepare_route_meta(routes_data)
+        for color, _, route in route_meta:
+            # Locals del loop interno: un lookup de dict por ruta, no por pasajero
+            bus_id = route['bus_id']
+            passengers = route['passengers']
+
+            for passenger_idx, passenger in enumerate(passengers):
+                name = passenger['name']
+                marker_data.append([
+                    passenger['lat'], passenger['lng'],
+                    _POPUP_TMPL.format(bus=bus_id, name=name, n=passenger_idx + 1),
+                    _TOOLTIP_TMPL.format(name=name, bus=bus_id),
+                    color
+                ])
+
+            # Recorrido si existe, sino route_coordinates
+            route_coords = route.get('real_route_geometry', route.get('route_coordinates', []))
+            if len(route_coords) > 2:
+                # Simplificar y truncar a 5 decimales (~1 m): menos vértices y
+                # números más cortos en el JSON embebido del mapa
+                route_coords = [[round(lat, 5), round(lng, 5)]
+                                for lat, lng in _simplify_polyline(route_coords)]
+            if len(route_coords) > 1:
+                # Todas las rutas van en un solo FeatureCollection GeoJSON:
+                # una capa Leaflet con una pasada de estilo, en vez de un
+                # objeto PolyLine (y sus listeners) por bus
+                route_features.append({
+                    'type': 'Feature',
+                    'geometry': {
+                        'type': 'LineString',
+                        'coordinates': [[lng, lat] for lat, lng in route_coords]
+                    },
+                    'properties': {
+                        'color': color,
+                        'bus_id': bus_id,
+                        'passengers_count': route['passengers_count']
+                    }
+                })
+
+        if route_features:
+            folium.GeoJson(
+                {'type': 'FeatureCollection', 'features': route_features},
+                name='Rutas',
+                style_function=lambda feature: {
+                    'color': feature['properties']['color'],
+                    'weight': 3,
+                    'opacity': 0.9
+                },
+                tooltip=folium.GeoJsonTooltip(fields=['bus_id', 'passengers_count'],
+                                              aliases=['Ruta', 'Pasajeros'])
+            ).add_to(m)
+
+        if marker_data:
+            passengers_group = folium.FeatureGroup(name="Pasajeros")
+            FastMarkerCluster(marker_data, callback=_MARKER_CALLBACK).add_to(passengers_group)
+            passengers_group.add_to(m)
+
+
+        # Agregar leyenda (reutiliza la pasada de metadatos del mapa).
+        # folium.Element emite el string tal cual, sin el <div> wrapper de
+        # 100% x 100% de branca.Html que desplazaba el mapa fuera de pantalla
+        legend_html = self._create_legend(routes_data, route_meta, total_capacity, as_of)
+        m.get_root().html.add_child(folium.Element(legend_html), name='legend')
+        
+        if save_path:
+            self._save_map(m, save_path)
+            print(f"Mapa guardado en: {save_path}")
+
+        return m
+
+    def _save_map(self, m: folium.Map, save_path: str) -> None:
+        """Renderiza el mapa una vez y lo escribe en un solo write binario
+
+        Codificar a bytes antes de abrir evita el wrapper de texto (y su
+        codificación incremental): el HTML completo baja al kernel en una
+        sola llamada en vez de trozos del buffer por defecto.
+
+        Con extensión .gz el HTML se comprime (~5x) antes de escribir, listo
+        para servirse con Content-Encoding: gzip.
+        """
+        data = m.get_root().render().encode('utf-8')
+        if save_path.endswith('.gz'):
+            data = gzip.compress(data, compresslevel=6)
+        with open(save_path, 'wb') as f:
+            f.write(data)
+    
+    def _create_legend(self, routes_data: Dict, route_meta=None, total_capacity=None,
+                       as_of: datetime = None) -> str:
+        """Leyenda o convenciones
+
+        as_of fija el timestamp del footer: con una marca estable el HTML es
+        determinista y se puede cachear/hashear; por defecto usa la hora actual.
+        """
+        if route_meta is None:
+            route_meta, total_capacity = self._prepare_route_meta(routes_data)
+
+        # map() itera en C sobre las tuplas de meta; join consume sin lista previa
+        rows = ''.join(map(_legend_row, route_meta))
+
+        # Métricas dashboard
+        total_buses = routes_data['summary']['total_buses']
+        total_passengers = routes_data['summary']['total_passengers']
+        utilization = routes_data['summary']['utilization_rate'] * 100
+
+        stats = _LEGEND_STATS.format(
+            total_buses=total_buses,
+            total_passengers=total_passengers,
+            utilization=utilization,
+            empty_seats=total_capacity - total_passengers,
+            total_capacity=total_capacity,
+            avg_passengers=total_passengers / total_buses if total_buses else 0.0,
+            timestamp=(as_of or datetime.now()).strftime('%H:%M')
+        )
+
+        return ''.join((_LEGEND_HEADER, rows, stats, _LEGEND_FOOTER))
\ No newline at end of file